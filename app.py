@@ -17,7 +17,7 @@ with st.sidebar:
         builder.process_pdf(path); st.success("Indexed!")
 
 scroll = builder.client.scroll(COLLECTION_NAME, limit=100)
-docs = list(set([p.payload['doc_name'] for p in scroll[0]]))
+docs = list(set([p.payload['doc_name'] for p in scroll[0] if 'doc_name' in p.payload]))
 sel = st.selectbox("Select Document", docs)
 if sel:
     q = st.text_input("Ask Question")
@@ -0,0 +1,116 @@
+"""
+Reports on-disk index size and filtered search latency for an embedded Qdrant index.
+Run it before and after a storage change (e.g. `python text_store.py`) to compare.
+
+    python benchmark.py
+    python benchmark.py --collection library_docs --store library_text.db --key doc_name   # Streamlit index
+    python benchmark.py --library-sizes 10 100 1000 --partitions 16   # synthetic scaling run
+"""
+import os
+import time
+import random
+import argparse
+from qdrant_client import models
+from index_service import connect_index
+from partitions import all_collections, collection_for, ensure_collection
+from config import DB_PATH, SERVER_COLLECTION_NAME, SERVER_TEXT_STORE_PATH
+
+
+def path_size(path) -> int:
+    """Size in bytes of a file or of everything under a directory."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def filter_values(client, collection_name, key, limit=10000):
+    points, _ = client.scroll(collection_name, limit=limit, with_payload=[key])
+    return sorted({p.payload[key] for p in points if key in p.payload})
+
+
+def search(client, collection_name, vector, query_filter, limit=5):
+    try:
+        return client.search(collection_name=collection_name, query_vector=vector, query_filter=query_filter, limit=limit)
+    except AttributeError:
+        return client.query_points(collection_name=collection_name, query=vector, query_filter=query_filter, limit=limit).points
+
+
+def bench_filtered_search(client, collection_of, key, values, runs=50, dim=1024):
+    """
+    Times filtered searches with random query vectors. `collection_of(value)` names the
+    collection (partition) holding that filter value. Returns latencies in ms.
+    """
+    latencies = []
+    for _ in range(runs):
+        vector = [random.gauss(0, 1) for _ in range(dim)]
+        value = random.choice(values)
+        query_filter = models.Filter(
+            must=[models.FieldCondition(key=key, match=models.MatchValue(value=value))]
+        )
+        start = time.perf_counter()
+        search(client, collection_of(value), vector, query_filter)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def bench_library_sizes(sizes, partitions, chunks_per_doc=20, runs=50, dim=1024):
+    """Filtered-search latency against library size, single collection vs partitions, on synthetic in-memory indexes."""
+    import numpy as np
+    from qdrant_client import QdrantClient
+
+    for n_docs in sizes:
+        for parts in sorted({1, partitions}):
+            client = QdrantClient(":memory:")
+            for name in all_collections("bench", parts):
+                ensure_collection(client, name)
+            doc_ids = [f"doc_{i}" for i in range(n_docs)]
+            next_id = 0
+            for doc_id in doc_ids:
+                vectors = np.random.randn(chunks_per_doc, dim).astype(np.float32)
+                points = [models.PointStruct(id=next_id + i, vector=v.tolist(), payload={"doc_id": doc_id}) for i, v in enumerate(vectors)]
+                next_id += chunks_per_doc
+                client.upsert(collection_name=collection_for("bench", doc_id, parts), points=points)
+            latencies = bench_filtered_search(client, lambda v: collection_for("bench", v, parts), "doc_id", doc_ids, runs=runs, dim=dim)
+            print(f"{n_docs:>6} docs x {chunks_per_doc} chunks, {parts:>3} partition(s): "
+                  f"p50 {percentile(latencies, 50):.1f} ms, p95 {percentile(latencies, 95):.1f} ms")
+            client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DB_PATH, help="Embedded Qdrant path (ignored when INDEX_URL is set)")
+    parser.add_argument("--collection", default=SERVER_COLLECTION_NAME)
+    parser.add_argument("--store", default=SERVER_TEXT_STORE_PATH)
+    parser.add_argument("--key", default="doc_id", help="Payload field to filter on (doc_name for the Streamlit index)")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--partitions", type=int, default=1, help="INDEX_PARTITIONS the index was built with")
+    parser.add_argument("--library-sizes", type=int, nargs="+", help="Benchmark synthetic libraries of these document counts instead")
+    args = parser.parse_args()
+
+    if args.library_sizes:
+        bench_library_sizes(args.library_sizes, args.partitions, runs=args.runs)
+        raise SystemExit
+
+    print(f"Qdrant storage: {path_size(args.db) / 1e6:.1f} MB")
+    if os.path.exists(args.store):
+        print(f"Text store:     {path_size(args.store) / 1e6:.1f} MB")
+
+    client = connect_index(args.db)
+    collections = [c for c in all_collections(args.collection, args.partitions) if client.collection_exists(c)]
+    points = sum(client.count(c).count for c in collections)
+    values = sorted({v for c in collections for v in filter_values(client, c, args.key)})
+    if not values:
+        print(f"No points with payload field '{args.key}' in {args.collection}")
+    else:
+        collection_of = (lambda v: collection_for(args.collection, v, args.partitions)) if args.key == "doc_id" else (lambda v: args.collection)
+        latencies = bench_filtered_search(client, collection_of, args.key, values, runs=args.runs)
+        print(f"Filtered search over {points} points / {len(values)} documents: "
+              f"p50 {percentile(latencies, 50):.1f} ms, p95 {percentile(latencies, 95):.1f} ms")
@@ -0,0 +1,103 @@
+"""
+Cancelling an Ollama generation from another thread.
+
+Ollama only stops generating when its HTTP connection goes away, and the
+generation thread is blocked reading that connection: during prefill it waits
+for response headers, later for the next token. GenerationCancel.set() shuts
+the socket down, which wakes the blocked read at once and makes Ollama abort.
+The sockets are captured when the connection is opened, through a small httpx
+transport, so this works before Ollama has sent anything back.
+"""
+import socket
+import threading
+import httpx
+import httpcore
+import ollama
+
+
+class GenerationCancel(threading.Event):
+    """Cancellation flag shared by the request handler and the generation thread."""
+
+    def __init__(self):
+        super().__init__()
+        self._sockets = []
+        self._lock = threading.Lock()
+
+    def attach(self, sock):
+        """Registers a socket of this generation's Ollama connection."""
+        with self._lock:
+            self._sockets.append(sock)
+        if self.is_set():
+            self._shutdown(sock)
+
+    def detach(self):
+        """Forgets the sockets once the stream is closed, so they are never shut down later."""
+        with self._lock:
+            self._sockets = []
+
+    def set(self):
+        super().set()
+        with self._lock:
+            sockets = list(self._sockets)
+        for sock in sockets:
+            self._shutdown(sock)
+
+    @staticmethod
+    def _shutdown(sock):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # Already closed
+
+
+class _TrackingBackend(httpcore.SyncBackend):
+    def __init__(self, cancel_event: GenerationCancel):
+        self.cancel_event = cancel_event
+
+    def connect_tcp(self, *args, **kwargs):
+        stream = super().connect_tcp(*args, **kwargs)
+        self.cancel_event.attach(stream.get_extra_info("socket"))
+        return stream
+
+
+class _ResponseStream(httpx.SyncByteStream):
+    def __init__(self, stream):
+        self._stream = stream
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        self._stream.close()
+
+
+class _CancellableTransport(httpx.BaseTransport):
+    """httpx transport whose connections are registered with a GenerationCancel."""
+
+    def __init__(self, cancel_event: GenerationCancel):
+        self._pool = httpcore.ConnectionPool(network_backend=_TrackingBackend(cancel_event))
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        response = self._pool.handle_request(httpcore.Request(
+            method=request.method,
+            url=httpcore.URL(scheme=request.url.raw_scheme, host=request.url.raw_host, port=request.url.port, target=request.url.raw_path),
+            headers=request.headers.raw,
+            content=request.stream,
+            extensions=request.extensions,
+        ))
+        return httpx.Response(
+            status_code=response.status,
+            headers=response.headers,
+            stream=_ResponseStream(response.stream),
+            extensions=response.extensions,
+        )
+
+    def close(self):
+        self._pool.close()
+
+
+def ollama_client(timeout: float, cancel_event: GenerationCancel = None) -> ollama.Client:
+    """Ollama client whose every wait is bounded by `timeout` and which `cancel_event` can cut off."""
+    if cancel_event is None:
+        return ollama.Client(timeout=timeout)
+    return ollama.Client(timeout=timeout, transport=_CancellableTransport(cancel_event))
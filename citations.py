@@ -0,0 +1,93 @@
+import re
+
+# • "<exact quote>" (Page N), tolerating other bullets and curly quotes
+EVIDENCE_RE = re.compile(r'^\s*[•*\-]\s*["“](.+?)["”]\s*\(\s*pages?\s*(\d+)', re.IGNORECASE)
+_ELLIPSIS_RE = re.compile(r"\.\.\.|…")
+_WORD_RE = re.compile(r"\w+")
+_QUOTE_CHARS = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'", "–": "-", "—": "-"})
+SHINGLE_SIZE = 3
+FUZZY_THRESHOLD = 0.6
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.translate(_QUOTE_CHARS).lower().split())
+
+
+def _shingles(text: str) -> set:
+    # Punctuation is ignored so "starting." and "starting" match
+    words = _WORD_RE.findall(text)
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+class CitationVerifier:
+    """
+    Checks the model's `• "<quote>" (Page N)` evidence lines against the
+    retrieved chunks while the answer streams.
+
+    Text passes through unchanged as it arrives; when an evidence line ends, a
+    short mark is inserted before its newline:
+      [✓ verified]           quote found on the cited page
+      [⚠ found on page X]    quote exists, but on another page
+      [≈ close match]        no exact match, but most of its word shingles match
+      [✗ not in sources]     nothing similar in the retrieved chunks
+    """
+
+    def __init__(self, chunks):
+        """`chunks` is a list of (page_number, text) for the context sent to the model."""
+        self.chunks = [(page, normalize(text)) for page, text in chunks]
+        # Shingle -> indexes of chunks containing it, for fuzzy lookups
+        self.shingle_index = {}
+        for i, (_, text) in enumerate(self.chunks):
+            for shingle in _shingles(text):
+                self.shingle_index.setdefault(shingle, set()).add(i)
+        self.line = ""
+
+    def feed(self, text: str) -> str:
+        """Returns `text` with verification marks added to any evidence line it completes."""
+        parts = text.split("\n")
+        out = []
+        for i, part in enumerate(parts):
+            self.line += part
+            out.append(part)
+            if i < len(parts) - 1:
+                out.append(self._mark(self.line))
+                out.append("\n")
+                self.line = ""
+        return "".join(out)
+
+    def flush(self) -> str:
+        """Mark for a final evidence line that did not end with a newline."""
+        mark = self._mark(self.line)
+        self.line = ""
+        return mark
+
+    def _mark(self, line: str) -> str:
+        match = EVIDENCE_RE.match(line)
+        if not match:
+            return ""
+        cited_page = int(match.group(2))
+        # The model may elide with "..."; every fragment must then appear in one chunk
+        fragments = [normalize(f) for f in _ELLIPSIS_RE.split(match.group(1))]
+        fragments = [f.strip(" .,;:") for f in fragments if f.strip(" .,;:")]
+        if not fragments:
+            return ""
+
+        pages = {page for page, text in self.chunks if all(f in text for f in fragments)}
+        if pages:
+            if cited_page in pages:
+                return " [✓ verified]"
+            return f" [⚠ found on page {min(pages)}]"
+
+        shingles = _shingles(" ".join(fragments))
+        if shingles:
+            hits = {}
+            for shingle in shingles:
+                for i in self.shingle_index.get(shingle, ()):
+                    hits[i] = hits.get(i, 0) + 1
+            best = max(hits, key=hits.get, default=None)
+            if best is not None and hits[best] / len(shingles) >= FUZZY_THRESHOLD:
+                best_page = self.chunks[best][0]
+                if best_page == cited_page:
+                    return " [≈ close match]"
+                return f" [≈ close match, page {best_page}]"
+        return " [✗ not in sources]"
@@ -1,8 +1,15 @@
 ﻿import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PDF_INPUT_DIR = os.path.join(BASE_DIR, "pdfs")
-DB_PATH = os.path.join(BASE_DIR, "qdrant_db")
-COLLECTION_NAME = "local_docs"
+# Shared with server.py; run index_service.py and set INDEX_URL to use both at once
+DB_PATH = os.path.join(BASE_DIR, "qdrant_data")
+# The Streamlit app keeps its own collection and text store: its chunk ids and
+# ingest checkpoints are keyed by file name, like the server's, and would collide
+COLLECTION_NAME = "library_docs"
+TEXT_STORE_PATH = os.path.join(BASE_DIR, "library_text.db")
+# server.py's index (see core_ai.py), the default for the maintenance scripts
+SERVER_COLLECTION_NAME = "local_docs"
+SERVER_TEXT_STORE_PATH = os.path.join(BASE_DIR, "chunk_text.db")
 INGEST_MODEL_PATH = os.path.join(BASE_DIR, "models", "qwen2.5-14b-instruct-q4_k_m.gguf")
 QA_MODEL_PATH = os.path.join(BASE_DIR, "models", "qwen2.5-7b-instruct-q4_k_m.gguf")
 EMBED_MODEL_NAME = "BAAI/bge-large-en-v1.5"
@@ -1,14 +1,46 @@
-import ollama
+import re
+import html
+import time
+import threading
+import functools
 from pathlib import Path
-from qdrant_client import QdrantClient, models
+from qdrant_client import models
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from text_store import TextStore
+from index_service import connect_index
+from partitions import collection_for
+from sessions import ChatSession, SessionStore
+from citations import CitationVerifier
+from cancellation import GenerationCancel, ollama_client
 
 # --- CONFIGURATION ---
 BASE_DIR = Path(__file__).resolve().parent
 DB_PATH = BASE_DIR / "qdrant_data"
+TEXT_STORE_PATH = BASE_DIR / "chunk_text.db"
 COLLECTION_NAME = "local_docs"
+INDEX_PARTITIONS = 1   # >1 spreads documents over local_docs_NNN collections (see partitions.py)
 EMBED_MODEL_NAME = "BAAI/bge-large-en-v1.5"
 LLM_MODEL = "qwen2.5:7b-instruct"
+LLM_MAX_TOKENS = 1024   # Hard cap on generated tokens per answer
+LLM_MAX_SECONDS = 120   # Wall-clock cap on a single generation
+LLM_MAX_CONCURRENT = 2  # Generations the local model serves at once (match OLLAMA_NUM_PARALLEL)
+LLM_MAX_QUEUE = 16      # Requests allowed to wait for a generation slot
+LLM_MAX_QUEUE_PER_CLIENT = 4
+LLM_MAX_WAIT_SECONDS = 60  # Queued requests that can't start by then are shed
+SESSION_IDLE_SECONDS = 1800   # Chat sessions are dropped after this much inactivity
+SESSION_MAX = 256
+SESSION_MAX_CHUNKS = 20       # Retrieved chunks remembered per session
+SESSION_HISTORY_TOKENS = 1024 # Prior turns sent to the LLM, newest first
+SESSION_REUSE_SIMILARITY = 0.8  # Follow-ups this close to the last question reuse its chunks
+SESSION_EXTRA_HITS = 2        # New chunks fetched to extend a reused set
+INGEST_BATCH_SIZE = 64        # Chunks embedded and upserted per ingestion batch
+VERIFY_CITATIONS = True       # Mark Evidence quotes as verified/unverified while streaming
+
+# Counters for generations cut short because the client went away.
+# cancelled_tokens_max_saved is an upper bound: the unused part of each cancelled
+# answer's LLM_MAX_TOKENS budget, not tokens the model would actually have produced.
+generation_stats = {"cancelled_requests": 0, "cancelled_tokens_max_saved": 0}
+_stats_lock = threading.Lock()
 
 print("Initializing AI Core Models...")
 
@@ -16,16 +48,101 @@ print("Initializing AI Core Models...")
 # 1. Embedding Model for Vector Search
 embed_model = HuggingFaceEmbedding(model_name=EMBED_MODEL_NAME, device="cpu")
 
-# 3. Database Client
-client = QdrantClient(path=str(DB_PATH))
+# 3. Database Client (embedded, or the shared index service when INDEX_URL is set)
+client = connect_index(DB_PATH)
+
+# 4. Chunk text lives outside Qdrant; payloads only carry doc_id and page_number
+text_store = TextStore(TEXT_STORE_PATH)
+
+# 5. Multi-turn chat state
+sessions = SessionStore(max_sessions=SESSION_MAX, idle_seconds=SESSION_IDLE_SECONDS, max_chunks=SESSION_MAX_CHUNKS)
+
+def _record_cancellation(tokens_generated: int):
+    """Counts a cancelled generation and the most tokens it could still have produced."""
+    with _stats_lock:
+        generation_stats["cancelled_requests"] += 1
+        generation_stats["cancelled_tokens_max_saved"] += max(LLM_MAX_TOKENS - tokens_generated, 0)
+
+def _dot(a, b) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+@functools.lru_cache(maxsize=1024)
+def embed_query(query: str) -> tuple:
+    """Query embedding, cached because users repeat and refine the same questions."""
+    return tuple(embed_model.get_query_embedding(query))
+
+def doc_collection(doc_id: str) -> str:
+    """Collection (partition) holding a document's chunks."""
+    return collection_for(COLLECTION_NAME, doc_id, INDEX_PARTITIONS)
+
+def search_chunks(query_vector, doc_id: str, limit: int = 5, exclude_ids=None, with_vectors: bool = False, offset: int = 0):
+    """Vector search restricted to one document, optionally skipping already known chunk ids."""
+    query_filter = models.Filter(
+        must=[
+            models.FieldCondition(
+                key="doc_id",
+                match=models.MatchValue(value=doc_id)
+            )
+        ],
+        must_not=[models.HasIdCondition(has_id=list(exclude_ids))] if exclude_ids else None,
+    )
+    
+    try:
+        return client.search(collection_name=doc_collection(doc_id), query_vector=query_vector, query_filter=query_filter, limit=limit, offset=offset, with_vectors=with_vectors)
+    except AttributeError:
+        # Fallback for client versions where 'search' might be missing or replaced by 'query_points'
+        return client.query_points(collection_name=doc_collection(doc_id), query=query_vector, query_filter=query_filter, limit=limit, offset=offset, with_vectors=with_vectors).points
+
+_STOPWORDS = {"the", "and", "for", "what", "how", "does", "with", "this", "that", "are", "from", "which", "when", "where", "why", "who", "can", "about"}
+
+def make_snippet(text: str, query: str, width: int = 240) -> str:
+    """HTML-escaped excerpt of `text` around the first query term, with terms wrapped in <mark>."""
+    terms = [t for t in re.findall(r"\w+", query.lower()) if len(t) > 2 and t not in _STOPWORDS]
+    pattern = re.compile("|".join(re.escape(t) for t in terms), re.IGNORECASE) if terms else None
+    match = pattern.search(text) if pattern else None
+    start = max(0, match.start() - width // 3) if match else 0
+    excerpt = text[start:start + width]
+    if pattern:
+        # Split on the terms first so escaping never touches the <mark> tags
+        parts = pattern.split(excerpt)
+        found = pattern.findall(excerpt)
+        snippet = html.escape(parts[0]) + "".join(
+            f"<mark>{html.escape(term)}</mark>{html.escape(rest)}" for term, rest in zip(found, parts[1:])
+        )
+    else:
+        snippet = html.escape(excerpt)
+    return ("..." if start > 0 else "") + snippet + ("..." if start + width < len(text) else "")
 
-def retrieve_and_answer(query: str, doc_id: str):
+def search_passages(query: str, doc_id: str, limit: int = 10, offset: int = 0) -> list:
+    """Retrieval only: ranked chunks with page numbers, scores and highlighted snippets."""
+    hits = search_chunks(list(embed_query(query)), doc_id, limit=limit, offset=offset)
+    texts = text_store.get_texts(hit.id for hit in hits)
+    results = []
+    for hit in hits:
+        text = texts.get(str(hit.id)) or hit.payload.get("text", "")
+        results.append({
+            "chunk_id": str(hit.id),
+            "page_number": hit.payload.get("page_number", 0),
+            "score": round(hit.score, 4),
+            "snippet": make_snippet(text, query),
+        })
+    return results
+
+def retrieve_and_answer(query: str, doc_id: str, cancel_event: GenerationCancel = None, session: ChatSession = None):
     """
     Performs the RAG pipeline:
     1. Embed Query
     2. Vector Search (Filter by doc_id)
     3. Rerank Results
     4. Generate Answer with Citations
+
+    Setting `cancel_event` (from any thread) cuts the upstream Ollama
+    connection, so the model stops generating for a reader that is gone,
+    even while it is still reading the prompt.
+
+    With a `session`, prior turns are sent to the LLM and a follow-up close to
+    the previous question reranks the chunks already retrieved, plus a few new
+    ones, instead of running a full fresh search.
     """
     
     # Optimization: Handle simple greetings instantly to save time
@@ -34,22 +151,19 @@ def retrieve_and_answer(query: str, doc_id: str):
         return
 
     # --- STEP 1: Vector Search ---
-    query_vector = embed_model.get_query_embedding(query)
-    
-    query_filter = models.Filter(
-        must=[
-            models.FieldCondition(
-                key="doc_id",
-                match=models.MatchValue(value=doc_id)
-            )
-        ]
-    )
+    query_vector = list(embed_query(query))
     
-    try:
-        search_result = client.search(collection_name=COLLECTION_NAME, query_vector=query_vector, query_filter=query_filter, limit=5)
-    except AttributeError:
-        # Fallback for client versions where 'search' might be missing or replaced by 'query_points'
-        search_result = client.query_points(collection_name=COLLECTION_NAME, query=query_vector, query_filter=query_filter, limit=5).points
+    if session is not None and session.chunks and _dot(query_vector, session.query_vector) >= SESSION_REUSE_SIMILARITY:
+        # Follow-up on the same topic: narrowly extend the known chunk set
+        new_hits = search_chunks(query_vector, doc_id, limit=SESSION_EXTRA_HITS, exclude_ids=session.chunks.keys(), with_vectors=True)
+        session.remember_hits(session.query_vector, new_hits)
+        candidates = list(session.chunks.values())
+        # bge embeddings are normalized, so the dot product is the cosine score
+        search_result = sorted(candidates, key=lambda hit: _dot(query_vector, hit.vector), reverse=True)[:5]
+    else:
+        search_result = search_chunks(query_vector, doc_id, limit=5, with_vectors=session is not None)
+        if session is not None:
+            session.remember_hits(query_vector, search_result)
     
     if not search_result:
         yield "Information not found in the selected document."
@@ -59,11 +173,16 @@ def retrieve_and_answer(query: str, doc_id: str):
     
     # --- STEP 3: Context Construction ---
     # We wrap chunks in XML tags to help the LLM identify page numbers
+    texts = text_store.get_texts(hit.id for hit in top_hits)
     context_str = ""
+    context_chunks = []
     for hit in top_hits:
         page = hit.payload["page_number"]
-        text = hit.payload["text"]
+        # Points ingested before the text store still carry their text in the payload
+        text = texts.get(str(hit.id)) or hit.payload.get("text", "")
         context_str += f'<chunk page="{page}">\n{text}\n</chunk>\n\n'
+        context_chunks.append((page, text))
+    verifier = CitationVerifier(context_chunks) if VERIFY_CITATIONS else None
 
     # --- STEP 4: LLM Generation ---
     system_prompt = (
@@ -81,13 +200,51 @@ def retrieve_and_answer(query: str, doc_id: str):
     )
     
     user_prompt = f"Context:\n{context_str}\n\nQuestion: {query}"
+    history = session.history_messages(SESSION_HISTORY_TOKENS) if session is not None else []
     
+    if cancel_event is not None and cancel_event.is_set():
+        _record_cancellation(0)  # Reader left during retrieval
+        return
+    stream = None
+    generated = 0
+    finished = False
+    # The timeout bounds every wait on Ollama, including a prefill that never produces a token
+    llm = ollama_client(LLM_MAX_SECONDS, cancel_event)
     try:
-        stream = ollama.chat(model=LLM_MODEL, messages=[
+        stream = llm.chat(model=LLM_MODEL, messages=[
             {'role': 'system', 'content': system_prompt},
+            *history,
             {'role': 'user', 'content': user_prompt},
-        ], stream=True)
+        ], stream=True, options={"num_predict": LLM_MAX_TOKENS})
+        deadline = time.time() + LLM_MAX_SECONDS
+        answer_parts = []
         for chunk in stream:
-            yield chunk['message']['content']
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            generated += 1
+            answer_parts.append(chunk['message']['content'])
+            yield verifier.feed(answer_parts[-1]) if verifier else answer_parts[-1]
+            if time.time() > deadline:
+                if verifier:
+                    yield verifier.flush()
+                yield "\n\n_[Answer truncated: time limit reached]_"
+                break
+        else:
+            finished = True
+        if verifier and not (cancel_event is not None and cancel_event.is_set()):
+            yield verifier.flush()
+        if session is not None and answer_parts and not (cancel_event is not None and cancel_event.is_set()):
+            # History carries the bare question; the context chunks are rebuilt per turn
+            session.add_turn(query, "".join(answer_parts))
     except Exception as e:
-        yield f"Error communicating with LLM: {str(e)}"
+        if cancel_event is None or not cancel_event.is_set():
+            yield f"Error communicating with LLM: {str(e)}"
+    finally:
+        # Closing the stream drops the HTTP connection, which makes Ollama abort the generation
+        if stream is not None:
+            stream.close()
+        if cancel_event is not None:
+            cancel_event.detach()
+        if not finished and cancel_event is not None and cancel_event.is_set():
+            _record_cancellation(generated)
+            print(f"Generation cancelled after {generated} tokens")
@@ -0,0 +1,68 @@
+import os
+import gzip
+import json
+import hashlib
+from pathlib import Path
+from ocr import OCR_MIN_CHARS, OCR_DPI, OCR_LANG, fitz_lock, ocr_available, ocr_pages
+
+# --- CONFIGURATION ---
+CACHE_DIR = Path(__file__).resolve().parent / "extract_cache"
+# Bump whenever extraction or cleaning changes, so stale cache entries are ignored
+EXTRACTOR_VERSION = 1
+
+
+def file_hash(file_path) -> str:
+    """SHA-256 of the file contents, read in blocks."""
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def clean_text(text: str) -> str:
+    """Basic cleaning: collapse whitespace."""
+    return " ".join(text.split())
+
+
+def _cache_tag() -> str:
+    # OCR output differs from a plain extraction, so it gets its own cache entries
+    tag = f"v{EXTRACTOR_VERSION}"
+    if ocr_available():
+        tag += f"-ocr{OCR_DPI}{OCR_LANG}"
+    return tag
+
+
+def _extract(file_path) -> list:
+    import fitz  # PyMuPDF, only needed on a cache miss
+
+    # Shares the OCR render lock: another upload may be rendering pages right now
+    with fitz_lock, fitz.open(file_path) as doc:
+        pages = [clean_text(page.get_text("text")) for page in doc]
+    if ocr_available():
+        # Scanned pages have no text layer; read them with OCR instead of dropping them
+        scanned = [i for i, text in enumerate(pages) if len(text) < OCR_MIN_CHARS]
+        for i, text in ocr_pages(file_path, scanned).items():
+            pages[i] = clean_text(text)
+    return pages
+
+
+def extract_pages(file_path) -> list:
+    """
+    Returns the cleaned text of every page (index 0 is page 1), empty pages included.
+    Results are cached on disk by file hash and extractor version, so re-chunking
+    and re-embedding a library never has to re-parse the PDFs.
+    """
+    cache_path = CACHE_DIR / f"{file_hash(file_path)}-{_cache_tag()}.json.gz"
+    if cache_path.exists():
+        with gzip.open(cache_path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    pages = _extract(file_path)
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(f".tmp{os.getpid()}")
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(pages, f)
+    os.replace(tmp_path, cache_path)  # Atomic, so a crash never leaves a truncated entry
+    return pages
@@ -0,0 +1,272 @@
+"""
+Shared retrieval/index process.
+
+Embedded Qdrant (`QdrantClient(path=...)`) takes an exclusive lock on its
+storage folder, so only one process can open it. This service owns the
+storage and serves the client methods we use over local HTTP, so any number
+of API workers, the Streamlit app and the ingest scripts can share one index.
+
+    python index_service.py                 # serves ./qdrant_data on 127.0.0.1:6555
+    INDEX_URL=http://127.0.0.1:6555 python server.py
+
+Calls travel as JSON (qdrant models as their model_dump()), never pickle, and
+every request must carry the shared token from INDEX_TOKEN or `.index_token`,
+which the service creates readable by its own user only.
+"""
+import os
+import enum
+import hmac
+import json
+import argparse
+import builtins
+import importlib
+import secrets
+import threading
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_DB_PATH = BASE_DIR / "qdrant_data"
+DEFAULT_PORT = 6555
+TOKEN_PATH = BASE_DIR / ".index_token"
+TOKEN_HEADER = "X-Index-Token"
+
+# Only models and enums from these modules are ever rebuilt from a request or response.
+# qdrant_client.models is not used for lookups: its fastembed names shadow some REST models.
+MODEL_MODULES = {"qdrant_client.http.models.models", "qdrant_client.fastembed_common"}
+
+# Client methods the service exposes, and whether they modify the index
+READ_METHODS = {"search", "query_points", "count", "scroll", "retrieve", "collection_exists", "get_collection", "get_collections"}
+WRITE_METHODS = {"upsert", "delete", "delete_payload", "set_payload", "create_collection", "create_payload_index", "update_collection", "delete_collection"}
+
+
+def load_token(create: bool = False) -> str:
+    """Shared secret for the service: INDEX_TOKEN, else the token file (created by the service)."""
+    token = os.environ.get("INDEX_TOKEN")
+    if token:
+        return token
+    if TOKEN_PATH.exists():
+        return TOKEN_PATH.read_text().strip()
+    if not create:
+        raise RuntimeError(f"No index token: set INDEX_TOKEN or start index_service.py to create {TOKEN_PATH}")
+    token = secrets.token_urlsafe(32)
+    fd = os.open(TOKEN_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token)
+    return token
+
+
+def _encode(value):
+    """JSON-safe form of call arguments and results. Qdrant models and enums are tagged with their module and class."""
+    if hasattr(value, "model_dump"):
+        return {"__model__": _class_path(value), "data": value.model_dump(mode="json")}
+    if isinstance(value, enum.Enum):
+        return {"__enum__": _class_path(value), "value": value.value}
+    if isinstance(value, tuple):
+        return {"__tuple__": [_encode(v) for v in value]}
+    if isinstance(value, dict):
+        return {str(k): _encode(v) for k, v in value.items()}
+    if isinstance(value, (list, set, frozenset, type({}.keys()))):
+        return [_encode(v) for v in value]
+    if hasattr(value, "tolist"):  # numpy vectors
+        return value.tolist()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f"Cannot send {type(value).__name__} to the index service")
+
+
+def _class_path(value) -> str:
+    cls = type(value)
+    if cls.__module__ not in MODEL_MODULES:
+        raise TypeError(f"Cannot send {cls.__module__}.{cls.__name__} to the index service")
+    return f"{cls.__module__}:{cls.__name__}"
+
+
+def _model_class(path: str, base):
+    module_name, _, name = path.partition(":")
+    if module_name not in MODEL_MODULES or not name.isidentifier() or name.startswith("_"):
+        raise ValueError(f"Unknown qdrant type: {path}")
+    cls = getattr(importlib.import_module(module_name), name, None)
+    if not (isinstance(cls, type) and issubclass(cls, base)):
+        raise ValueError(f"Unknown qdrant type: {path}")
+    return cls
+
+
+def _decode(value):
+    """Inverse of _encode. Only classes from MODEL_MODULES are ever rebuilt."""
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if "__model__" in value:
+        from pydantic import BaseModel
+        return _model_class(value["__model__"], BaseModel).model_validate(value["data"])
+    if "__enum__" in value:
+        return _model_class(value["__enum__"], enum.Enum)(value["value"])
+    if "__tuple__" in value:
+        return tuple(_decode(v) for v in value["__tuple__"])
+    return {k: _decode(v) for k, v in value.items()}
+
+
+def _error(e: Exception) -> dict:
+    return {"ok": False, "error": type(e).__name__, "message": str(e)}
+
+
+def _raise(result: dict):
+    # Builtin exception types are kept, so callers' `except AttributeError` fallbacks still work
+    exc_type = getattr(builtins, result["error"], None)
+    if isinstance(exc_type, type) and issubclass(exc_type, Exception):
+        raise exc_type(result["message"])
+    raise RuntimeError(f"{result['error']}: {result['message']}")
+
+
+class IndexClient:
+    """Drop-in stand-in for QdrantClient that forwards calls to the index service."""
+
+    def __init__(self, url: str, timeout: float = 60.0):
+        import httpx
+
+        self.url = url.rstrip("/")
+        self.http = httpx.Client(timeout=timeout, headers={TOKEN_HEADER: load_token()})
+
+    def __getattr__(self, method):
+        if method not in READ_METHODS | WRITE_METHODS:
+            raise AttributeError(f"Index service does not expose '{method}'")
+
+        def call(*args, **kwargs):
+            response = self.http.post(f"{self.url}/rpc/{method}", json={"args": _encode(list(args)), "kwargs": _encode(kwargs)})
+            response.raise_for_status()
+            result = response.json()
+            if not result["ok"]:
+                _raise(result)
+            return _decode(result["value"])
+        return call
+
+
+def connect_index(path):
+    """
+    Returns an index client: the shared service if INDEX_URL is set,
+    otherwise an embedded QdrantClient that owns `path` exclusively.
+    """
+    url = os.environ.get("INDEX_URL")
+    if url:
+        return IndexClient(url)
+    from qdrant_client import QdrantClient
+    return QdrantClient(path=str(path))
+
+
+class _ReadWriteLock:
+    """Many concurrent searches, one writer at a time. Waiting writers block new readers."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire(self, write: bool):
+        with self._cond:
+            if write:
+                self._writers_waiting += 1
+                while self._writer or self._readers:
+                    self._cond.wait()
+                self._writers_waiting -= 1
+                self._writer = True
+            else:
+                while self._writer or self._writers_waiting:
+                    self._cond.wait()
+                self._readers += 1
+
+    def release(self, write: bool):
+        with self._cond:
+            if write:
+                self._writer = False
+            else:
+                self._readers -= 1
+            self._cond.notify_all()
+
+
+def check_round_trip():
+    """
+    Sends the calls the apps make, and their results, through the wire format
+    on a scratch in-memory index. Raises if anything does not come back equal,
+    e.g. after a qdrant-client upgrade renames or moves a model.
+    """
+    from qdrant_client import QdrantClient, models
+
+    client = QdrantClient(":memory:")
+    client.create_collection("check", vectors_config=models.VectorParams(size=4, distance=models.Distance.COSINE))
+    point_id = "00000000-0000-0000-0000-000000000001"
+    client.upsert("check", points=[models.PointStruct(id=point_id, vector=[0.1, 0.2, 0.3, 0.4], payload={"doc_id": "a.pdf", "page_number": 1})])
+    query_filter = models.Filter(
+        must=[models.FieldCondition(key="doc_id", match=models.MatchValue(value="a.pdf"))],
+        must_not=[models.HasIdCondition(has_id=["00000000-0000-0000-0000-000000000002"])],
+    )
+    calls = {
+        "query_points": ((), {"collection_name": "check", "query": [0.1, 0.2, 0.3, 0.4], "query_filter": query_filter, "limit": 5, "with_vectors": True}),
+        "scroll": (("check",), {"limit": 10, "with_payload": ["doc_id"]}),
+        "count": ((), {"collection_name": "check", "count_filter": query_filter, "exact": True}),
+        "get_collection": (("check",), {}),
+    }
+    if hasattr(client, "search"):  # Removed in qdrant-client 1.16
+        calls["search"] = ((), {"collection_name": "check", "query_vector": [0.1, 0.2, 0.3, 0.4], "query_filter": query_filter, "limit": 5})
+    try:
+        for method, (args, kwargs) in calls.items():
+            sent = _decode(json.loads(json.dumps(_encode(list(args))))), _decode(json.loads(json.dumps(_encode(kwargs))))
+            if sent != (list(args), kwargs):
+                raise RuntimeError(f"Arguments of {method} do not survive the index service wire format")
+            result = getattr(client, method)(*args, **kwargs)
+            if _decode(json.loads(json.dumps(_encode(result)))) != result:
+                raise RuntimeError(f"Result of {method} does not survive the index service wire format")
+    finally:
+        client.close()
+
+
+def create_app(db_path):
+    from fastapi import FastAPI, HTTPException, Request
+    from starlette.concurrency import run_in_threadpool
+    from qdrant_client import QdrantClient
+
+    check_round_trip()
+    app = FastAPI()
+    client = QdrantClient(path=str(db_path))
+    lock = _ReadWriteLock()
+    token = load_token(create=True)
+
+    @app.post("/rpc/{method}")
+    async def rpc(method: str, request: Request):
+        # Checked before the body is read: a browser page can post to localhost, but not with this header
+        if not hmac.compare_digest(request.headers.get(TOKEN_HEADER, ""), token):
+            raise HTTPException(status_code=403, detail="Missing or wrong index token")
+        if method not in READ_METHODS | WRITE_METHODS:
+            raise HTTPException(status_code=404, detail=f"Unknown method: {method}")
+        try:
+            body = await request.json()
+            args, kwargs = _decode(body["args"]), _decode(body["kwargs"])
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Bad request: {e}")
+        write = method in WRITE_METHODS
+
+        def call():
+            lock.acquire(write)
+            try:
+                return {"ok": True, "value": _encode(getattr(client, method)(*args, **kwargs))}
+            except Exception as e:
+                return _error(e)
+            finally:
+                lock.release(write)
+
+        return await run_in_threadpool(call)
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve one embedded Qdrant index to many local processes.")
+    parser.add_argument("--db", default=str(DEFAULT_DB_PATH))
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    print(f"Index service for {args.db} at http://127.0.0.1:{args.port}")
+    uvicorn.run(create_app(args.db), host="127.0.0.1", port=args.port)
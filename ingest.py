@@ -1,8 +1,12 @@
-﻿import os, fitz, uuid
+﻿import os
 import torch
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+from qdrant_client.models import PointStruct, Filter, FieldCondition, MatchValue, FilterSelector
 from sentence_transformers import SentenceTransformer
+from text_store import TextStore
+from index_service import connect_index
+from extract_cache import extract_pages, file_hash
+from pipeline import IngestPipeline
+from partitions import ensure_collection
 from config import *
 
 class DatasetBuilder:
@@ -12,20 +16,45 @@ class DatasetBuilder:
         else:
             print("⚠️ GPU Not Detected, using CPU")
         self.embed_model = SentenceTransformer(EMBED_MODEL_NAME, device="cuda")
-        self.client = QdrantClient(path=DB_PATH)
-        if not self.client.collection_exists(COLLECTION_NAME):
-            self.client.create_collection(COLLECTION_NAME, vectors_config=VectorParams(size=1024, distance=Distance.COSINE))
+        self.client = connect_index(DB_PATH)
+        self.text_store = TextStore(TEXT_STORE_PATH)
+        # This index filters by doc_name, so that is the tenant field
+        ensure_collection(self.client, COLLECTION_NAME, tenant_fields=("doc_name",))
 
     def process_pdf(self, file_path):
-        doc = fitz.open(file_path)
         doc_name = os.path.basename(file_path)
-        doc_id = str(uuid.uuid4())[:8]
-        points = []
-        for i in range(0, len(doc), 2):
-            window = doc[i : i + 2]
-            text = " ".join([p.get_text() for p in window])
-            vector = self.embed_model.encode(text).tolist()
-            points.append(PointStruct(id=str(uuid.uuid4()), vector=vector, payload={
-                "doc_name": doc_name, "text": text, "page_start": i+1, "page_end": min(i+2, len(doc))
-            }))
-        self.client.upsert(COLLECTION_NAME, points=points)
+        pdf_hash = file_hash(file_path)
+        progress = self.text_store.get_progress(doc_name)
+        start_after = 0
+        if progress and progress[0] == pdf_hash:
+            if progress[2]:
+                print(f"{doc_name} is already indexed")
+                return
+            start_after = progress[1]
+        elif progress:
+            # A different version was (partly) ingested; windows it no longer has would linger
+            self.client.delete(COLLECTION_NAME, points_selector=FilterSelector(
+                filter=Filter(must=[FieldCondition(key="doc_name", match=MatchValue(value=doc_name))])
+            ))
+            self.text_store.delete_doc(doc_name)
+
+        pages = extract_pages(file_path)
+        # Two-page windows are the unit of work; a window is keyed by its first page
+        windows = [(i + 1, " ".join(pages[i : i + 2])) for i in range(0, len(pages), 2)]
+
+        def chunk_window(page_start, text):
+            return [(text, {"doc_name": doc_name, "page_start": page_start, "page_end": min(page_start + 1, len(pages))})]
+
+        def embed(texts):
+            return self.embed_model.encode(texts, batch_size=32).tolist()
+
+        def commit_batch(batch):
+            self.text_store.put_chunks((chunk_id, doc_name, payload["page_start"], text) for chunk_id, text, payload, _ in batch)
+            self.client.upsert(COLLECTION_NAME, points=[
+                PointStruct(id=chunk_id, vector=vector, payload=payload) for chunk_id, _, payload, vector in batch
+            ])
+
+        pipeline = IngestPipeline(chunk_window, embed, commit_batch, batch_size=32)
+        pipeline.run(doc_name, windows, start_after=start_after,
+                     on_commit=lambda last_page: self.text_store.set_progress(doc_name, pdf_hash, last_page))
+        self.text_store.set_progress(doc_name, pdf_hash, len(pages), done=True)
@@ -0,0 +1,99 @@
+"""
+OCR fallback for scanned pages.
+
+Pages with (almost) no text layer are rendered with PyMuPDF and read with
+Tesseract from a thread pool; pytesseract runs the tesseract binary as a
+subprocess, so pages are OCR'd in parallel. Results are cached per page by a
+hash of the rendered image, so re-ingesting or re-chunking a scanned manual
+never OCRs the same page twice. Needs `pytesseract`, Pillow and the tesseract
+binary; without them scanned pages are skipped as before.
+"""
+import os
+import gzip
+import time
+import hashlib
+import threading
+import functools
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# --- CONFIGURATION ---
+OCR_ENABLED = True
+OCR_MIN_CHARS = 20   # Pages with less extracted text than this are OCR'd
+OCR_DPI = 300
+OCR_LANG = "eng"
+OCR_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+OCR_CACHE_DIR = Path(__file__).resolve().parent / "extract_cache" / "ocr"
+
+# MuPDF is not thread-safe: every PyMuPDF call in the process (here and in
+# extract_cache) holds this lock, so only Tesseract runs in parallel
+fitz_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def ocr_available() -> bool:
+    if not OCR_ENABLED:
+        return False
+    try:
+        import pytesseract
+        from PIL import Image  # noqa: F401
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception as e:
+        print(f"⚠️ OCR unavailable, scanned pages will be skipped: {e}")
+        return False
+
+
+def _ocr_page(job):
+    """
+    Renders one page and OCRs it unless cached. Returns (page_index, text, seconds, cached).
+    A page that fails is logged and left empty, so one bad page never loses the others.
+    """
+    file_path, page_index, dpi, lang = job
+    start = time.perf_counter()
+    try:
+        text, cached = _read_page(file_path, page_index, dpi, lang)
+    except Exception as e:
+        print(f"    page {page_index + 1}: OCR failed, left empty: {e}")
+        text, cached = "", False
+    return page_index, text, time.perf_counter() - start, cached
+
+
+def _read_page(file_path, page_index, dpi, lang):
+    import fitz
+    import pytesseract
+    from PIL import Image
+
+    with fitz_lock, fitz.open(file_path) as doc:
+        pix = doc[page_index].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    cache_path = OCR_CACHE_DIR / f"{hashlib.sha256(pix.samples).hexdigest()}-{dpi}-{lang}.txt.gz"
+    if cache_path.exists():
+        with gzip.open(cache_path, "rt", encoding="utf-8") as f:
+            return f.read(), True
+
+    image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    text = pytesseract.image_to_string(image, lang=lang)
+
+    OCR_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(f".tmp{os.getpid()}-{threading.get_ident()}")
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, cache_path)
+    return text, False
+
+
+def ocr_pages(file_path, page_indexes) -> dict:
+    """OCRs the given 0-based pages in parallel. Returns {page_index: raw text}."""
+    if not page_indexes:
+        return {}
+    jobs = [(str(file_path), i, OCR_DPI, OCR_LANG) for i in page_indexes]
+    results = {}
+    start = time.perf_counter()
+    print(f"  - OCR {len(jobs)} scanned page(s) of {os.path.basename(file_path)} on {min(OCR_WORKERS, len(jobs))} worker(s)...")
+    # Threads, not processes: spawned workers would re-import the server (models, index lock)
+    with ThreadPoolExecutor(max_workers=min(OCR_WORKERS, len(jobs))) as pool:
+        for page_index, text, seconds, cached in pool.map(_ocr_page, jobs):
+            results[page_index] = text
+            print(f"    page {page_index + 1}: {seconds:.2f}s{' (cached)' if cached else ''}")
+    print(f"  - OCR done in {time.perf_counter() - start:.1f}s")
+    return results
@@ -0,0 +1,123 @@
+"""
+Tenant-aware partitioning of the document index.
+
+Every query is restricted to one document, so each collection is set up for
+multitenancy: a tenant keyword index on the document field and per-tenant
+HNSW graphs (payload_m) instead of one global graph. Embedded Qdrant ignores
+payload indexes and filters point by point, so large libraries can also be
+spread over several collections (`local_docs_000`, ...) picked by a hash of
+the doc_id. A filtered search then only scans one partition.
+
+    python partitions.py --partitions 16   # move an existing single collection
+"""
+import zlib
+import argparse
+import functools
+from qdrant_client import models
+
+VECTOR_SIZE = 1024
+
+
+def collection_for(base_name: str, doc_id: str, partitions: int) -> str:
+    """Collection that holds `doc_id`. With one partition this is the base collection."""
+    if partitions <= 1:
+        return base_name
+    return f"{base_name}_{zlib.crc32(doc_id.encode('utf-8')) % partitions:03d}"
+
+
+def all_collections(base_name: str, partitions: int) -> list:
+    if partitions <= 1:
+        return [base_name]
+    return [f"{base_name}_{i:03d}" for i in range(partitions)]
+
+
+def _tenant_index_schema():
+    try:
+        return models.KeywordIndexParams(type="keyword", is_tenant=True)
+    except AttributeError:
+        # qdrant-client before 1.11 has no tenant flag; a plain keyword index still helps
+        return models.PayloadSchemaType.KEYWORD
+
+
+def is_embedded(client) -> bool:
+    """
+    True for embedded Qdrant (a path or ":memory:"), which has no payload
+    indexes. The index service always runs one, so its clients count too.
+    """
+    from index_service import IndexClient
+
+    if isinstance(client, IndexClient):
+        return True
+    return type(getattr(client, "_client", None)).__name__ == "QdrantLocal"
+
+
+@functools.lru_cache(maxsize=None)
+def _note_no_payload_indexes():
+    print("ℹ️ Embedded Qdrant has no payload indexes: filtered searches scan their whole collection "
+          "(INDEX_PARTITIONS keeps that small). Use a Qdrant server for tenant indexes.")
+
+
+def ensure_collection(client, name: str, tenant_fields=("doc_id",)):
+    """Creates the collection if needed and makes sure every tenant field is indexed."""
+    if not client.collection_exists(name):
+        print(f"Creating collection: {name}")
+        try:
+            client.create_collection(
+                collection_name=name,
+                vectors_config=models.VectorParams(size=VECTOR_SIZE, distance=models.Distance.COSINE),
+                # Graphs per document only; no query searches across documents
+                hnsw_config=models.HnswConfigDiff(payload_m=16, m=0),
+            )
+        except Exception:
+            # Forked server workers start together; another one may have just created it
+            if not client.collection_exists(name):
+                raise
+    if is_embedded(client):
+        # Creating indexes there only warns, and the schema never reports them
+        _note_no_payload_indexes()
+        return
+    schema = client.get_collection(name).payload_schema or {}
+    for field in tenant_fields:
+        if field not in schema:
+            print(f"Creating tenant index on {name}.{field}")
+            try:
+                client.create_payload_index(collection_name=name, field_name=field, field_schema=_tenant_index_schema())
+            except Exception:
+                if field not in (client.get_collection(name).payload_schema or {}):
+                    raise
+
+
+def migrate_to_partitions(client, base_name: str, partitions: int, tenant_field: str = "doc_id", batch_size: int = 256) -> int:
+    """Moves points from the base collection into their partitions. Returns the number moved."""
+    for name in all_collections(base_name, partitions):
+        ensure_collection(client, name, (tenant_field,))
+    moved = 0
+    offset = None
+    while True:
+        points, offset = client.scroll(base_name, limit=batch_size, offset=offset, with_payload=True, with_vectors=True)
+        groups = {}
+        for p in points:
+            if tenant_field in p.payload:
+                target = collection_for(base_name, p.payload[tenant_field], partitions)
+                groups.setdefault(target, []).append(models.PointStruct(id=p.id, vector=p.vector, payload=p.payload))
+        for target, group in groups.items():
+            if target != base_name:
+                client.upsert(collection_name=target, points=group)
+                client.delete(collection_name=base_name, points_selector=models.PointIdsList(points=[p.id for p in group]))
+                moved += len(group)
+        if offset is None:
+            break
+    return moved
+
+
+if __name__ == "__main__":
+    from index_service import connect_index
+    from config import DB_PATH, SERVER_COLLECTION_NAME
+
+    parser = argparse.ArgumentParser(description="Move documents from the single collection into partitions.")
+    parser.add_argument("--db", default=DB_PATH, help="Embedded Qdrant path (ignored when INDEX_URL is set)")
+    parser.add_argument("--partitions", type=int, required=True, help="Must match INDEX_PARTITIONS in core_ai.py")
+    args = parser.parse_args()
+
+    moved = migrate_to_partitions(connect_index(args.db), SERVER_COLLECTION_NAME, args.partitions)
+    print(f"Moved {moved} points into {args.partitions} partitions")
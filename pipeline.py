@@ -0,0 +1,117 @@
+import uuid
+import queue
+import threading
+
+_DONE = object()
+
+
+class IngestPipeline:
+    """
+    Streaming ingestion: extract -> chunk -> embed -> upsert.
+
+    Each stage runs in its own thread and hands work to the next through a
+    bounded queue, so only `queue_size` batches are ever held in memory and
+    upserts of one batch overlap with embedding of the next.
+
+    - chunk_fn(page_number, text) -> [(chunk_text, payload)]
+    - embed_fn([texts]) -> [vectors]
+    - sink_fn([(chunk_id, chunk_text, payload, vector)]) commits one batch
+
+    Batches always end on a page boundary and chunk ids are derived from
+    (doc_key, page, index), so a run that stopped part way can resume after the
+    last committed page and re-upserting a page is idempotent.
+    """
+
+    def __init__(self, chunk_fn, embed_fn, sink_fn, batch_size=64, queue_size=4):
+        self.chunk_fn = chunk_fn
+        self.embed_fn = embed_fn
+        self.sink_fn = sink_fn
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+
+    def run(self, doc_key: str, pages, start_after: int = 0, on_commit=None) -> int:
+        """
+        Ingests `pages`, an iterable of (page_number, text), skipping pages up to
+        `start_after`. Calls on_commit(last_page) after each committed batch.
+        Returns the number of chunks committed.
+        """
+        stop = threading.Event()
+        errors = []
+        page_q = queue.Queue(self.queue_size)
+        chunk_q = queue.Queue(self.queue_size)
+        embed_q = queue.Queue(self.queue_size)
+
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(q):
+            while True:
+                try:
+                    return q.get(timeout=0.5)
+                except queue.Empty:
+                    if stop.is_set():
+                        return _DONE
+
+        def extract():
+            for page_number, text in pages:
+                if page_number > start_after and not put(page_q, (page_number, text)):
+                    return
+            put(page_q, _DONE)
+
+        def chunk():
+            batch, last_page = [], start_after
+            while (item := get(page_q)) is not _DONE:
+                last_page, text = item
+                for i, (chunk_text, payload) in enumerate(self.chunk_fn(last_page, text)):
+                    chunk_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{doc_key}:{last_page}:{i}"))
+                    batch.append((chunk_id, chunk_text, payload))
+                if len(batch) >= self.batch_size:
+                    if not put(chunk_q, (last_page, batch)):
+                        return
+                    batch = []
+            if batch:
+                put(chunk_q, (last_page, batch))
+            put(chunk_q, _DONE)
+
+        def embed():
+            while (item := get(chunk_q)) is not _DONE:
+                last_page, batch = item
+                vectors = self.embed_fn([c[1] for c in batch])
+                if not put(embed_q, (last_page, [(*c, v) for c, v in zip(batch, vectors)])):
+                    return
+            put(embed_q, _DONE)
+
+        def stage(fn):
+            def runner():
+                try:
+                    fn()
+                except Exception as e:
+                    errors.append(e)
+                    stop.set()
+            thread = threading.Thread(target=runner, daemon=True)
+            thread.start()
+            return thread
+
+        threads = [stage(extract), stage(chunk), stage(embed)]
+        committed = 0
+        try:
+            # Upsert stage runs on the calling thread
+            while (item := get(embed_q)) is not _DONE:
+                last_page, batch = item
+                self.sink_fn(batch)
+                committed += len(batch)
+                if on_commit is not None:
+                    on_commit(last_page)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+        return committed
@@ -0,0 +1,156 @@
+import time
+import asyncio
+from collections import OrderedDict, deque
+
+
+class SchedulerBusy(Exception):
+    """Raised when a generation request is shed instead of queued."""
+
+
+class _Ticket:
+    def __init__(self, client_id: str, deadline: float):
+        self.client_id = client_id
+        self.deadline = deadline
+        self.started_at = None
+        self.state = "queued"  # queued -> running -> done
+        self.granted = asyncio.Event()
+
+
+class GenerationScheduler:
+    """
+    Admission control in front of the local LLM.
+
+    At most `max_concurrent` generations run at once; the rest wait in a bounded
+    queue. Waiting clients are served round-robin so one chatty client cannot
+    starve the others, and requests that cannot start before their deadline are
+    shed with a fast "busy" instead of timing out later.
+
+    With `slots`, a semaphore shared by forked server workers, a request also
+    needs one of its permits to start, so the limit holds across processes.
+
+    All methods must be called from the event loop thread.
+    """
+
+    def __init__(self, max_concurrent=2, max_queue=16, max_per_client=4, max_wait=60.0, slots=None):
+        self.max_concurrent = max_concurrent
+        self.slots = slots
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client
+        self.max_wait = max_wait
+        self.running = 0
+        # client_id -> deque of tickets; dict order is the round-robin order
+        self.waiting = OrderedDict()
+        # Moving average of generation time, used to estimate queue wait
+        self.avg_duration = 20.0
+        self.stats = {"admitted": 0, "shed": 0, "completed": 0}
+
+    def queued(self) -> int:
+        return sum(len(q) for q in self.waiting.values())
+
+    def check_admission(self, client_id: str):
+        """Raises SchedulerBusy if a new request from `client_id` would be shed right now."""
+        queued = self.queued()
+        if self.running < self.max_concurrent and queued == 0:
+            return
+        if queued >= self.max_queue:
+            raise SchedulerBusy("Server busy: generation queue is full. Please retry shortly.")
+        if len(self.waiting.get(client_id, ())) >= self.max_per_client:
+            raise SchedulerBusy("Too many pending questions from this client. Please wait for them to finish.")
+        # Each full round of running slots must finish before this request starts
+        estimated_wait = (queued // self.max_concurrent + 1) * self.avg_duration
+        if estimated_wait > self.max_wait:
+            raise SchedulerBusy(f"Server busy: estimated wait {estimated_wait:.0f}s. Please retry shortly.")
+
+    def submit(self, client_id: str) -> _Ticket:
+        """Admits a request or raises SchedulerBusy. The returned ticket must be released."""
+        try:
+            self.check_admission(client_id)
+        except SchedulerBusy:
+            self.stats["shed"] += 1
+            raise
+        ticket = _Ticket(client_id, time.monotonic() + self.max_wait)
+        self.waiting.setdefault(client_id, deque()).append(ticket)
+        self.stats["admitted"] += 1
+        self._dispatch()
+        return ticket
+
+    def position(self, ticket: _Ticket) -> int:
+        """1-based position of a queued ticket in round-robin service order."""
+        queues = list(self.waiting.values())
+        pos = 0
+        depth = 0
+        while True:
+            remaining = False
+            for q in queues:
+                if depth < len(q):
+                    remaining = True
+                    pos += 1
+                    if q[depth] is ticket:
+                        return pos
+            if not remaining:
+                return 0
+            depth += 1
+
+    async def wait(self, ticket: _Ticket):
+        """Yields the ticket's queue position whenever it changes, until it may start."""
+        last = None
+        while ticket.state == "queued":
+            pos = self.position(ticket)
+            if pos != last:
+                yield pos
+                last = pos
+            remaining = ticket.deadline - time.monotonic()
+            if remaining <= 0:
+                self._remove(ticket)
+                ticket.state = "done"
+                self.stats["shed"] += 1
+                raise SchedulerBusy("Server busy: your question waited too long in the queue. Please retry.")
+            try:
+                # Shared slots are freed by other processes without notice, so poll for them more often
+                await asyncio.wait_for(ticket.granted.wait(), timeout=min(remaining, 0.2 if self.slots else 1.0))
+            except asyncio.TimeoutError:
+                self._dispatch()
+
+    def release(self, ticket: _Ticket):
+        """Frees the ticket's slot (or queue entry) and starts the next waiting request."""
+        if ticket.state == "queued":
+            self._remove(ticket)
+        elif ticket.state == "running":
+            self.running -= 1
+            if self.slots is not None:
+                self.slots.release()
+            self.stats["completed"] += 1
+            duration = time.monotonic() - ticket.started_at
+            self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+        ticket.state = "done"
+        self._dispatch()
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "running": self.running,
+            "queued": self.queued(),
+            "avg_generation_seconds": round(self.avg_duration, 2),
+        }
+
+    def _remove(self, ticket: _Ticket):
+        q = self.waiting.get(ticket.client_id)
+        if q and ticket in q:
+            q.remove(ticket)
+            if not q:
+                del self.waiting[ticket.client_id]
+
+    def _dispatch(self):
+        while self.running < self.max_concurrent and self.waiting:
+            if self.slots is not None and not self.slots.acquire(block=False):
+                return  # Every slot on the node is busy in some worker
+            client_id, q = next(iter(self.waiting.items()))
+            ticket = q.popleft()
+            # Move this client to the back of the rotation
+            del self.waiting[client_id]
+            if q:
+                self.waiting[client_id] = q
+            ticket.state = "running"
+            ticket.started_at = time.monotonic()
+            self.running += 1
+            ticket.granted.set()
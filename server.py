@@ -1,19 +1,32 @@
 import os
 import glob
 import shutil
-import uuid
 import time
-import fitz  # PyMuPDF
-from contextlib import asynccontextmanager
+import uuid
+import asyncio
+import sqlite3
+from contextlib import asynccontextmanager, closing
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from typing import Optional
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request, BackgroundTasks
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, StreamingResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 from llama_index.core import Document
 from llama_index.core.node_parser import SemanticSplitterNodeParser
 from qdrant_client import models
-from core_ai import retrieve_and_answer, embed_model, client, COLLECTION_NAME
+from core_ai import (
+    retrieve_and_answer, search_passages, doc_collection, embed_model, client, text_store, sessions,
+    COLLECTION_NAME, INDEX_PARTITIONS, DB_PATH, TEXT_STORE_PATH, generation_stats,
+    LLM_MAX_CONCURRENT, LLM_MAX_QUEUE, LLM_MAX_QUEUE_PER_CLIENT, LLM_MAX_WAIT_SECONDS, INGEST_BATCH_SIZE,
+)
+from scheduler import GenerationScheduler, SchedulerBusy
+from cancellation import GenerationCancel
+from extract_cache import extract_pages, file_hash as hash_file
+from pipeline import IngestPipeline
+from partitions import all_collections, ensure_collection
+from benchmark import path_size
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -24,22 +37,33 @@ async def lifespan(app: FastAPI):
         docs_dir.mkdir(parents=True, exist_ok=True)
         print(f"Created directory: {docs_dir}")
 
-    # 2. Ensure Vector DB Collection exists
-    if not client.collection_exists(COLLECTION_NAME):
-        print(f"Creating collection: {COLLECTION_NAME}")
-        client.create_collection(
+    # 2. Ensure every Vector DB partition exists with its tenant index on doc_id
+    for name in all_collections(COLLECTION_NAME, INDEX_PARTITIONS):
+        ensure_collection(client, name)
+    if INDEX_PARTITIONS > 1 and client.collection_exists(COLLECTION_NAME):
+        # Server documents left in the base collection are invisible once partitioned
+        unpartitioned = client.count(
             collection_name=COLLECTION_NAME,
-            vectors_config=models.VectorParams(size=1024, distance=models.Distance.COSINE),
-        )
-        client.create_payload_index(
-            collection_name=COLLECTION_NAME,
-            field_name="doc_id",
-            field_schema=models.PayloadSchemaType.KEYWORD,
-        )
+            count_filter=models.Filter(must_not=[models.IsEmptyCondition(is_empty=models.PayloadField(key="doc_id"))]),
+            exact=True,
+        ).count
+        if unpartitioned:
+            print(f"⚠️ {COLLECTION_NAME} still holds unpartitioned documents. Run: python partitions.py --partitions {INDEX_PARTITIONS}")
     yield
 
 app = FastAPI(lifespan=lifespan)
 
+# Results of index compaction after deletes/replacements
+maintenance_stats = {"last_compaction": None, "last_reclaimed_bytes": 0, "total_reclaimed_bytes": 0}
+
+# Admission control in front of the LLM (one instance per server process)
+scheduler = GenerationScheduler(
+    max_concurrent=LLM_MAX_CONCURRENT,
+    max_queue=LLM_MAX_QUEUE,
+    max_per_client=LLM_MAX_QUEUE_PER_CLIENT,
+    max_wait=LLM_MAX_WAIT_SECONDS,
+)
+
 # Mount static files for the UI
 BASE_DIR = Path(__file__).resolve().parent
 app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
@@ -47,35 +71,100 @@ app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="stat
 class ChatRequest(BaseModel):
     doc_id: str
     query: str
+    session_id: Optional[str] = None  # Enables multi-turn context when set
 
 class ChatResponse(BaseModel):
     answer: str
 
-def load_pdf_content(file_path, doc_id):
-    """Extracts text from PDF for ingestion."""
+class SearchRequest(BaseModel):
+    doc_id: str
+    query: str
+    limit: int = Field(10, ge=1, le=50)
+    offset: int = Field(0, ge=0)
+
+def _doc_filter(doc_id):
+    return models.Filter(
+        must=[models.FieldCondition(key="doc_id", match=models.MatchValue(value=doc_id))]
+    )
+
+def load_pdf_content(file_path):
+    """Extracts text from PDF for ingestion (cached per file hash). Returns [(page_number, text)]."""
     try:
-        doc = fitz.open(file_path)
+        pages = extract_pages(file_path)
     except Exception as e:
         print(f"Error opening {file_path}: {e}")
         return []
 
-    documents = []
-    for page_num, page in enumerate(doc):
-        text = page.get_text("text")
-        text = " ".join(text.split())
-        if len(text) < 20: continue
-        
-        documents.append(
-            Document(
-                text=text,
-                metadata={
-                    "doc_id": doc_id,
-                    "doc_name": os.path.basename(file_path),
-                    "page_number": page_num + 1
-                }
-            )
+    # Skip empty/noise pages
+    return [(page_num + 1, text) for page_num, text in enumerate(pages) if len(text) >= 20]
+
+def ingest_document(pages, doc_id, file_hash, start_after=0):
+    """
+    Streams one document through chunk -> embed -> upsert in bounded batches,
+    checkpointing after every batch so an interrupted upload can resume.
+    """
+    splitter = SemanticSplitterNodeParser(
+        buffer_size=1,
+        breakpoint_percentile_threshold=95,
+        embed_model=embed_model
+    )
+
+    def chunk_page(page_number, text):
+        nodes = splitter.get_nodes_from_documents([Document(text=text)])
+        # Payload keeps only the filter fields; text goes to the text store
+        return [(node.get_content(), {"doc_id": doc_id, "page_number": page_number}) for node in nodes]
+
+    def commit_batch(batch):
+        # Text first, so every indexed point can be resolved
+        text_store.put_chunks((chunk_id, doc_id, payload["page_number"], text) for chunk_id, text, payload, _ in batch)
+        client.upsert(
+            collection_name=doc_collection(doc_id),
+            points=[models.PointStruct(id=chunk_id, vector=vector, payload=payload) for chunk_id, _, payload, vector in batch],
         )
-    return documents
+
+    text_store.put_pages(doc_id, dict(pages))
+    pipeline = IngestPipeline(chunk_page, embed_model.get_text_embedding_batch, commit_batch, batch_size=INGEST_BATCH_SIZE)
+    count = pipeline.run(
+        doc_id, pages, start_after=start_after,
+        on_commit=lambda last_page: text_store.set_progress(doc_id, file_hash, last_page),
+    )
+    text_store.set_progress(doc_id, file_hash, pages[-1][0], done=True)
+    return count
+
+def remove_document(doc_id):
+    """Deletes a document's points, stored text, ingest checkpoint and chat sessions. Returns points removed."""
+    collection = doc_collection(doc_id)
+    removed = client.count(collection_name=collection, count_filter=_doc_filter(doc_id), exact=True).count
+    if removed:
+        client.delete(collection_name=collection, points_selector=models.FilterSelector(filter=_doc_filter(doc_id)))
+    text_store.delete_doc(doc_id)
+    sessions.drop_doc(doc_id)
+    return removed
+
+def compact_index():
+    """Reclaims the disk space left by deleted points. Returns the bytes freed."""
+    before = path_size(DB_PATH) + path_size(TEXT_STORE_PATH)
+    for name in all_collections(COLLECTION_NAME, INDEX_PARTITIONS):
+        try:
+            # On a Qdrant server this kicks the optimizers, which vacuum segments with deleted points
+            client.update_collection(collection_name=name, optimizers_config=models.OptimizersConfigDiff())
+        except Exception as e:
+            print(f"Optimizer trigger skipped for {name}: {e}")
+        # Embedded Qdrant keeps points in SQLite, which only shrinks on VACUUM
+        storage = Path(DB_PATH) / "collection" / name / "storage.sqlite"
+        if storage.exists():
+            try:
+                with closing(sqlite3.connect(storage)) as conn:
+                    conn.execute("VACUUM")
+            except sqlite3.OperationalError as e:
+                print(f"Vacuum skipped for {name}: {e}")
+    text_store.vacuum()
+    freed = max(before - path_size(DB_PATH) - path_size(TEXT_STORE_PATH), 0)
+    maintenance_stats["last_compaction"] = time.time()
+    maintenance_stats["last_reclaimed_bytes"] = freed
+    maintenance_stats["total_reclaimed_bytes"] += freed
+    print(f"Compaction reclaimed {freed / 1e6:.1f} MB")
+    return freed
 
 @app.get("/")
 async def read_root():
@@ -94,14 +183,84 @@ async def list_documents():
     # Return list of dicts: [{'id': 'filename', 'name': 'filename'}]
     return [{"id": os.path.basename(f).replace(" ", "_"), "name": os.path.basename(f)} for f in files]
 
+def memory_usage():
+    """Resident, proportional (PSS), shared and private memory of this process in MB. Linux only."""
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    fields[key] = int(value.split()[0]) / 1024
+    except OSError:
+        return {}
+    return {
+        "rss_mb": round(fields.get("Rss", 0), 1),
+        "pss_mb": round(fields.get("Pss", 0), 1),
+        "shared_mb": round(fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0), 1),
+        "private_mb": round(fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0), 1),
+    }
+
+@app.get("/api/stats")
+async def get_stats():
+    """Reports generation counters (cancelled requests, upper bound on tokens saved), scheduler load and worker memory."""
+    return {
+        **generation_stats,
+        "scheduler": scheduler.snapshot(),
+        "maintenance": maintenance_stats,
+        "worker": {"pid": os.getpid(), **memory_usage()},
+    }
+
+@app.post("/api/search")
+def search_endpoint(request: SearchRequest):
+    """Retrieval only, no LLM: ranked passages with pages, scores and highlighted snippets."""
+    # Plain `def` so FastAPI runs the embedding + search in the threadpool
+    start_time = time.perf_counter()
+    results = search_passages(request.query, request.doc_id, limit=request.limit, offset=request.offset)
+    return {
+        "results": results,
+        "offset": request.offset,
+        "next_offset": request.offset + len(results) if len(results) == request.limit else None,
+        "took_ms": round((time.perf_counter() - start_time) * 1000, 1),
+    }
+
 @app.post("/api/chat")
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, http_request: Request):
     print(f"Querying {request.doc_id}: {request.query}")
+    client_id = http_request.headers.get("x-client-id") or http_request.client.host
+    try:
+        # Fast "busy" before any streaming starts
+        scheduler.check_admission(client_id)
+    except SchedulerBusy as e:
+        scheduler.stats["shed"] += 1
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+    cancel_event = GenerationCancel()
     
+    async def watch_disconnect():
+        # The token loop below is parked in the threadpool until Ollama sends something,
+        # which can be minutes into a long prefill, so the disconnect is watched separately
+        while (await http_request.receive())["type"] != "http.disconnect":
+            pass
+        print(f"Client disconnected, cancelling generation for {request.doc_id}")
+        cancel_event.set()
+
     async def response_generator():
         start_time = time.time()
+        ticket = None
+        answer = None
+        watcher = asyncio.get_running_loop().create_task(watch_disconnect())
         try:
-            for chunk in retrieve_and_answer(request.query, request.doc_id):
+            ticket = scheduler.submit(client_id)
+            # Tell the client where it stands until its generation starts
+            async for position in scheduler.wait(ticket):
+                yield f"[[queue:{position}]]"
+
+            session = sessions.get(request.session_id, request.doc_id) if request.session_id else None
+            answer = retrieve_and_answer(request.query, request.doc_id, cancel_event, session)
+            # Pull tokens in the threadpool so the event loop stays free to notice disconnects
+            async for chunk in iterate_in_threadpool(answer):
+                if cancel_event.is_set():
+                    return
                 yield chunk
             
             duration = time.time() - start_time
@@ -110,67 +269,211 @@ async def chat_endpoint(request: ChatRequest):
             else:
                 time_msg = f"({duration / 60:.2f} minutes)"
             yield f"\n\n_Response time: {time_msg}_"
+        except SchedulerBusy as e:
+            yield str(e)
         except Exception as e:
             print(f"Error: {e}")
             yield f"Error: {str(e)}"
+        finally:
+            watcher.cancel()
+            # Also covers Starlette cancelling the response task on disconnect. That cancellation
+            # waits for the thread-pooled next() to return, so the generator is idle here and the
+            # model is free once it is closed.
+            cancel_event.set()
+            if answer is not None:
+                answer.close()
+            if ticket is not None:
+                scheduler.release(ticket)
 
     return StreamingResponse(response_generator(), media_type="text/plain")
 
-@app.post("/api/upload")
-async def upload_document(file: UploadFile = File(...)):
-    """Uploads a PDF and ingests it immediately."""
+def _document_path(doc_id):
+    """Path of the PDF in the documents folder whose doc_id matches, or None."""
+    for f in glob.glob(str(BASE_DIR / "documents" / "*.pdf")):
+        if os.path.basename(f).replace(" ", "_") == doc_id:
+            return Path(f)
+    return None
+
+def _stage_upload(file: UploadFile, save_path: Path) -> Path:
+    """
+    Writes an upload next to its final path, under a unique name the documents
+    listing ignores. It only replaces `save_path` once it has been indexed.
+    """
+    staged_path = save_path.with_name(f".{save_path.name}.{uuid.uuid4().hex}.upload")
+    with open(staged_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+    return staged_path
+
+async def _save_and_ingest(file: UploadFile):
+    """Ingests an uploaded PDF unless already indexed, then saves it to the documents folder."""
     safe_name = os.path.basename(file.filename)
     save_path = BASE_DIR / "documents" / safe_name
-    
-    # 1. Save File
-    with open(save_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    # 2. Ingest
     doc_id = safe_name.replace(" ", "_")
     
-    # Check if exists in DB
-    count = client.count(
-        collection_name=COLLECTION_NAME,
-        count_filter=models.Filter(
-            must=[models.FieldCondition(key="doc_id", match=models.MatchValue(value=doc_id))]
-        )
-    ).count
-    
-    if count > 0:
-        return {"status": "exists", "filename": safe_name, "doc_id": doc_id}
+    # 1. Stage File: an "exists" answer must leave the indexed version on disk
+    staged_path = _stage_upload(file, save_path)
+    try:
+        # Hashing and extraction (possibly OCR) can take minutes; keep them off the event loop
+        file_hash = await run_in_threadpool(hash_file, staged_path)
+        progress = text_store.get_progress(doc_id)
+        start_after = 0
+        if progress is None:
+            # Documents ingested before progress tracking only show up in the index
+            count = client.count(
+                collection_name=doc_collection(doc_id),
+                count_filter=_doc_filter(doc_id)
+            ).count
+            if count > 0:
+                return {"status": "exists", "filename": safe_name, "doc_id": doc_id}
+        elif progress[2]:
+            return {"status": "exists", "filename": safe_name, "doc_id": doc_id}
+        elif progress[0] == file_hash:
+            # Same file, interrupted earlier: continue after the last committed batch
+            start_after = progress[1]
+            print(f"Resuming {doc_id} after page {start_after}")
+        else:
+            # A different file was partly ingested under this name; its chunks would outlive the restart
+            print(f"Discarding partial ingest of an older {doc_id}")
+            await run_in_threadpool(remove_document, doc_id)
 
-    # Process
-    raw_docs = load_pdf_content(str(save_path), doc_id)
-    if not raw_docs:
-        raise HTTPException(status_code=400, detail="Could not extract text from PDF")
+        # 2. Ingest
+        pages = await run_in_threadpool(load_pdf_content, str(staged_path))
+        if not pages:
+            raise HTTPException(status_code=400, detail="Could not extract text from PDF")
 
-    splitter = SemanticSplitterNodeParser(
-        buffer_size=1,
-        breakpoint_percentile_threshold=95,
-        embed_model=embed_model
-    )
-    
-    nodes = splitter.get_nodes_from_documents(raw_docs)
-    points = []
-    
-    for node in nodes:
-        vector = embed_model.get_text_embedding(node.get_content())
-        payload = {
-            "doc_id": doc_id,
-            "doc_name": node.metadata["doc_name"],
-            "page_number": node.metadata.get("page_number", 0),
-            "text": node.get_content(),
-            "chunk_id": str(uuid.uuid4())
-        }
-        points.append(models.PointStruct(id=payload["chunk_id"], vector=vector, payload=payload))
+        chunks = await run_in_threadpool(ingest_document, pages, doc_id, file_hash, start_after)
+        os.replace(staged_path, save_path)
+    finally:
+        if staged_path.exists():
+            staged_path.unlink()
         
-    if points:
-        client.upsert(collection_name=COLLECTION_NAME, points=points)
-        
-    return {"status": "success", "filename": safe_name, "doc_id": doc_id}
+    return {"status": "success", "filename": safe_name, "doc_id": doc_id, "chunks": chunks, "resumed_after_page": start_after}
+
+@app.post("/api/upload")
+async def upload_document(file: UploadFile = File(...)):
+    """Uploads a PDF and ingests it immediately."""
+    return await _save_and_ingest(file)
+
+@app.put("/api/documents/{doc_id}")
+async def replace_document(doc_id: str, background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+    """
+    Replaces a document with a new version of the same file. The upload is
+    extracted first; the old points and text are only removed once it is usable.
+    """
+    safe_name = os.path.basename(file.filename)
+    if safe_name.replace(" ", "_") != doc_id:
+        raise HTTPException(status_code=400, detail=f"'{safe_name}' is not {doc_id}; a replacement must keep the document's file name")
+    save_path = BASE_DIR / "documents" / safe_name
+
+    # A bad upload leaves the old version untouched
+    staged_path = _stage_upload(file, save_path)
+    try:
+        pages = await run_in_threadpool(load_pdf_content, str(staged_path))
+        if not pages:
+            raise HTTPException(status_code=400, detail="Could not extract text from PDF")
+        file_hash = await run_in_threadpool(hash_file, staged_path)
+
+        # Swap: a failed ingest below leaves a checkpoint, so re-uploading the file resumes it
+        old_path = _document_path(doc_id)
+        removed = await run_in_threadpool(remove_document, doc_id)
+        if old_path is not None and old_path != save_path:
+            old_path.unlink()
+        os.replace(staged_path, save_path)
+    finally:
+        if staged_path.exists():
+            staged_path.unlink()
+    chunks = await run_in_threadpool(ingest_document, pages, doc_id, file_hash)
+    background_tasks.add_task(compact_index)
+    return {"status": "replaced", "filename": safe_name, "doc_id": doc_id, "chunks": chunks, "points_removed": removed}
+
+@app.delete("/api/documents/{doc_id}")
+async def delete_document(doc_id: str, background_tasks: BackgroundTasks):
+    """Removes a document from the index and the documents folder, then compacts in the background."""
+    path = _document_path(doc_id)
+    removed = await run_in_threadpool(remove_document, doc_id)
+    if path is None and not removed:
+        raise HTTPException(status_code=404, detail=f"Unknown document: {doc_id}")
+    if path is not None:
+        path.unlink()
+    background_tasks.add_task(compact_index)
+    return {"status": "deleted", "doc_id": doc_id, "points_removed": removed}
+
+@app.post("/api/maintenance/compact")
+def compact_endpoint():
+    """Runs index compaction now and reports the space reclaimed."""
+    return {"reclaimed_bytes": compact_index()}
+
+def run_preforked(workers, host, port):
+    """
+    Preload-and-fork serving: the embedding model was loaded once when core_ai
+    was imported, and each worker is forked from this process so the weights
+    are shared copy-on-write instead of loaded per worker.
+    """
+    import gc
+    import signal
+    import socket
+    import multiprocessing
+    import torch
+    import uvicorn
+
+    if not hasattr(os, "fork"):
+        raise SystemExit("--workers needs fork() (Linux/macOS)")
+    if not os.environ.get("INDEX_URL"):
+        raise SystemExit("--workers needs the shared index: start index_service.py and set INDEX_URL")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    # Move everything loaded so far out of the GC's reach, so collections in the
+    # workers don't write to (and un-share) the pages holding the model objects
+    gc.collect()
+    gc.freeze()
+    # Split cores between workers so torch thread pools don't oversubscribe them.
+    # No inference may run before this point: forking after OpenMP starts can hang workers.
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    # LLM_MAX_CONCURRENT is for the whole node: every worker's scheduler draws from these permits
+    llm_slots = multiprocessing.BoundedSemaphore(LLM_MAX_CONCURRENT)
+
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            torch.set_num_threads(threads_per_worker)
+            text_store.reopen()
+            scheduler.slots = llm_slots
+            # Queue capacity is split between workers so the node total stays LLM_MAX_QUEUE
+            scheduler.max_queue = max(1, LLM_MAX_QUEUE // workers)
+            print(f"Worker {os.getpid()}: {threads_per_worker} torch threads, memory {memory_usage()}")
+            uvicorn.Server(uvicorn.Config(app, log_level="info")).run(sockets=[sock])
+            os._exit(0)
+        pids.append(pid)
+
+    def stop_workers(signum, frame):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+    for pid in pids:
+        os.waitpid(pid, 0)
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    print("Server running at http://localhost:8000")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="Forked workers sharing the preloaded models (needs INDEX_URL)")
+    args = parser.parse_args()
+
+    print(f"Server running at http://localhost:{args.port}")
+    if args.workers > 1:
+        run_preforked(args.workers, "0.0.0.0", args.port)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=args.port)
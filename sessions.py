@@ -0,0 +1,83 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+def _approx_tokens(text: str) -> int:
+    # Rough size estimate; good enough for budgeting prompt history
+    return len(text) // 4 + 1
+
+
+class ChatSession:
+    """Server-side state of one conversation about one document."""
+
+    def __init__(self, session_id: str, doc_id: str, max_chunks: int):
+        self.session_id = session_id
+        self.doc_id = doc_id
+        self.max_chunks = max_chunks
+        self.last_used = time.time()
+        self.turns = []            # [(question, answer)]
+        self.query_vector = None   # Vector of the last question that triggered a search
+        self.chunks = OrderedDict()  # chunk_id -> hit (with vector), most recent last
+
+    def remember_hits(self, query_vector, hits):
+        self.query_vector = query_vector
+        for hit in hits:
+            key = str(hit.id)
+            self.chunks.pop(key, None)
+            self.chunks[key] = hit
+        while len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last=False)
+
+    def add_turn(self, question: str, answer: str):
+        self.turns.append((question, answer))
+
+    def history_messages(self, budget_tokens: int) -> list:
+        """Most recent turns as chat messages, oldest first, within `budget_tokens`."""
+        messages = []
+        used = 0
+        for question, answer in reversed(self.turns):
+            cost = _approx_tokens(question) + _approx_tokens(answer)
+            if used + cost > budget_tokens:
+                break
+            used += cost
+            messages[:0] = [{'role': 'user', 'content': question}, {'role': 'assistant', 'content': answer}]
+        return messages
+
+
+class SessionStore:
+    """In-memory chat sessions with idle eviction and an upper bound on their number."""
+
+    def __init__(self, max_sessions=256, idle_seconds=1800, max_chunks=20):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.max_chunks = max_chunks
+        self.sessions = OrderedDict()  # session_id -> ChatSession, least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, session_id: str, doc_id: str) -> ChatSession:
+        """Returns the session, starting a fresh one if it is new, evicted or was about another document."""
+        with self.lock:
+            self._evict_idle()
+            session = self.sessions.pop(session_id, None)
+            if session is None or session.doc_id != doc_id:
+                session = ChatSession(session_id, doc_id, self.max_chunks)
+            session.last_used = time.time()
+            self.sessions[session_id] = session
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+            return session
+
+    def drop_doc(self, doc_id: str):
+        """Forgets every session about `doc_id` (e.g. after the document changed)."""
+        with self.lock:
+            for session_id in [s.session_id for s in self.sessions.values() if s.doc_id == doc_id]:
+                del self.sessions[session_id]
+
+    def _evict_idle(self):
+        cutoff = time.time() - self.idle_seconds
+        while self.sessions:
+            oldest = next(iter(self.sessions.values()))
+            if oldest.last_used >= cutoff:
+                break
+            self.sessions.popitem(last=False)
@@ -5,6 +5,18 @@ const sendBtn = document.getElementById('send-btn');
 const statusLabel = document.getElementById('system-status');
 const chatTitle = document.getElementById('chat-title');
 let currentDocId = null;
+let sessionId = null;
+
+function newId() {
+    return Math.random().toString(36).slice(2) + Date.now().toString(36);
+}
+
+// Stable per-browser id so the server can schedule clients fairly
+let clientId = localStorage.getItem('clientId');
+if (!clientId) {
+    clientId = newId();
+    localStorage.setItem('clientId', clientId);
+}
 
 async function loadDocs() {
     try {
@@ -22,6 +34,7 @@ async function loadDocs() {
 
 docSelect.addEventListener('change', (e) => {
     currentDocId = e.target.value;
+    sessionId = newId(); // New conversation per document
     chatTitle.textContent = e.target.options[e.target.selectedIndex].text;
     chatHistory.innerHTML = '';
     addMessage("System", `Document loaded. Ask a question.`);
@@ -36,13 +49,20 @@ async function sendMessage() {
     userInput.disabled = true;
     sendBtn.disabled = true;
     statusLabel.textContent = "Thinking...";
+    showSearchHits(text); // Passages arrive long before the answer
 
     try {
         const res = await fetch('/api/chat', {
             method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({ doc_id: currentDocId, query: text })
+            headers: {'Content-Type': 'application/json', 'X-Client-Id': clientId},
+            body: JSON.stringify({ doc_id: currentDocId, query: text, session_id: sessionId })
         });
+
+        if (!res.ok) {
+            const err = await res.json().catch(() => ({}));
+            addMessage("System", err.detail || "Server error.");
+            return;
+        }
         
         // Create a placeholder message for the AI
         const aiDiv = addMessage("AI", "");
@@ -55,7 +75,12 @@ async function sendMessage() {
             const { done, value } = await reader.read();
             if (done) break;
             const chunk = decoder.decode(value, { stream: true });
-            fullText += chunk;
+            // Queue position markers update the status line instead of the answer
+            fullText = (fullText + chunk).replace(/\[\[queue:(\d+)\]\]/g, (_, pos) => {
+                statusLabel.textContent = `Queued (position ${pos})...`;
+                return "";
+            });
+            if (fullText) statusLabel.textContent = "Thinking...";
             aiDiv.textContent = fullText; // Display raw text while streaming
             chatHistory.scrollTop = chatHistory.scrollHeight;
         }
@@ -81,9 +106,34 @@ async function sendMessage() {
     }
 }
 
+async function showSearchHits(query) {
+    // Reserve the slot now so the hits stay above the streamed answer
+    const div = document.createElement('div');
+    div.className = 'message hits';
+    div.hidden = true;
+    chatHistory.appendChild(div);
+    try {
+        const res = await fetch('/api/search', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({ doc_id: currentDocId, query: query, limit: 3 })
+        });
+        if (!res.ok) return;
+        const data = await res.json();
+        if (!data.results.length) return;
+        // Snippets are escaped server-side; only <mark> tags are added
+        div.innerHTML = '<strong>Top matches:</strong>' + data.results.map(r =>
+            `<div class="search-hit"><span class="hit-page">Page ${r.page_number}</span> ${r.snippet}</div>`).join('');
+        div.hidden = false;
+        chatHistory.scrollTop = chatHistory.scrollHeight;
+    } catch (e) { console.error(e); }
+}
+
 function formatText(text) {
     return text.replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;")
         .replace(/\*\*(.*?)\*\*/g, "<strong>$1</strong>")
+        // Citation check marks added by the server, e.g. [✓ verified]
+        .replace(/\[(✓|⚠|≈|✗)([^\]]*)\]/g, (m, sym) => `<span class="cite-mark cite-${{'✓': 'ok', '⚠': 'page', '≈': 'close', '✗': 'bad'}[sym]}">${m}</span>`)
         .replace(/\n/g, "<br>");
 }
 
@@ -16,13 +16,28 @@ async function loadFiles() {
             const div = document.createElement('div');
             div.className = 'file-item';
             div.textContent = "📄 " + d.name;
+            const del = document.createElement('button');
+            del.className = 'delete-btn';
+            del.textContent = "Delete";
+            del.addEventListener('click', () => deleteDoc(d));
+            div.appendChild(del);
             fileList.appendChild(div);
         });
     } catch (e) { console.error(e); }
 }
 
+async function deleteDoc(doc) {
+    if (!confirm(`Delete "${doc.name}" and remove it from the index?`)) return;
+    try {
+        const res = await fetch(`/api/documents/${encodeURIComponent(doc.id)}`, { method: 'DELETE' });
+        const data = await res.json();
+        statusMsg.textContent = res.ok ? `🗑️ Deleted ${doc.name} (${data.points_removed} chunks)` : "❌ Error: " + data.detail;
+        loadFiles();
+    } catch (e) { statusMsg.textContent = "❌ Network Error"; }
+}
+
 // Handle Upload
-async function handleUpload(file) {
+async function handleUpload(file, replaceId = null) {
     if (!file || file.type !== 'application/pdf') {
         statusMsg.textContent = "Error: Only PDF files are allowed.";
         return;
@@ -42,7 +57,11 @@ async function handleUpload(file) {
     let ingestTimer;
 
     const xhr = new XMLHttpRequest();
-    xhr.open('POST', '/api/upload', true);
+    if (replaceId) {
+        xhr.open('PUT', `/api/documents/${encodeURIComponent(replaceId)}`, true);
+    } else {
+        xhr.open('POST', '/api/upload', true);
+    }
 
     // Track Upload Progress
     xhr.upload.onprogress = (e) => {
@@ -72,6 +91,14 @@ async function handleUpload(file) {
 
         if (xhr.status === 200) {
             const data = JSON.parse(xhr.responseText);
+            if (data.status === "exists") {
+                progressContainer.style.display = "none";
+                statusMsg.textContent = "Already indexed: " + data.filename;
+                if (confirm(`"${data.filename}" is already indexed. Replace it with this file?`)) {
+                    handleUpload(file, data.doc_id);
+                }
+                return;
+            }
             statusMsg.textContent = "✅ Success: " + data.filename;
             progressBar.style.width = "100%";
             progressText.textContent = "Complete!";
@@ -0,0 +1,167 @@
+import zlib
+import sqlite3
+import argparse
+import threading
+
+
+class TextStore:
+    """
+    Compact on-disk store for chunk text, kept out of the Qdrant payloads.
+
+    Page text is stored once per page, zlib-compressed, and each chunk is a
+    (start, end) offset range into its page. Chunks whose text cannot be found
+    verbatim in a stored page (e.g. multi-page windows) keep their own
+    compressed copy instead.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                " doc_id TEXT, page_number INTEGER, text BLOB,"
+                " PRIMARY KEY (doc_id, page_number))"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " chunk_id TEXT PRIMARY KEY, doc_id TEXT, page_number INTEGER,"
+                " start INTEGER, end INTEGER, text BLOB)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_doc ON chunks (doc_id)")
+            # Ingestion checkpoints: every page up to last_page is committed to the index
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS ingest_progress ("
+                " doc_id TEXT PRIMARY KEY, file_hash TEXT, last_page INTEGER, done INTEGER)"
+            )
+
+    def reopen(self):
+        """Opens a fresh connection; SQLite connections must not be shared across fork()."""
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def put_pages(self, doc_id: str, pages: dict):
+        """Stores cleaned page text, `pages` maps page_number -> text."""
+        rows = [(doc_id, num, zlib.compress(text.encode("utf-8"))) for num, text in pages.items()]
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)", rows)
+
+    def put_chunks(self, chunks):
+        """
+        Stores chunk text. `chunks` is an iterable of (chunk_id, doc_id, page_number, text).
+        Chunks found inside their stored page are saved as offsets only.
+        """
+        page_cache = {}
+        rows = []
+        with self.lock:
+            for chunk_id, doc_id, page_number, text in chunks:
+                key = (doc_id, page_number)
+                if key not in page_cache:
+                    row = self.conn.execute(
+                        "SELECT text FROM pages WHERE doc_id = ? AND page_number = ?", key
+                    ).fetchone()
+                    page_cache[key] = zlib.decompress(row[0]).decode("utf-8") if row else None
+                page_text = page_cache[key]
+                start = page_text.find(text) if page_text is not None else -1
+                if start >= 0:
+                    rows.append((chunk_id, doc_id, page_number, start, start + len(text), None))
+                else:
+                    rows.append((chunk_id, doc_id, page_number, None, None, zlib.compress(text.encode("utf-8"))))
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def get_texts(self, chunk_ids) -> dict:
+        """Bulk-fetches text for the given chunk ids. Returns {chunk_id: text}."""
+        chunk_ids = [str(c) for c in chunk_ids]
+        if not chunk_ids:
+            return {}
+        marks = ",".join("?" * len(chunk_ids))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT chunk_id, doc_id, page_number, start, end, text FROM chunks WHERE chunk_id IN ({marks})",
+                chunk_ids,
+            ).fetchall()
+            page_keys = {(r[1], r[2]) for r in rows if r[5] is None}
+            pages = {}
+            for doc_id, page_number in page_keys:
+                row = self.conn.execute(
+                    "SELECT text FROM pages WHERE doc_id = ? AND page_number = ?", (doc_id, page_number)
+                ).fetchone()
+                if row:
+                    pages[(doc_id, page_number)] = zlib.decompress(row[0]).decode("utf-8")
+
+        texts = {}
+        for chunk_id, doc_id, page_number, start, end, blob in rows:
+            if blob is not None:
+                texts[chunk_id] = zlib.decompress(blob).decode("utf-8")
+            elif (doc_id, page_number) in pages:
+                texts[chunk_id] = pages[(doc_id, page_number)][start:end]
+        return texts
+
+    def get_progress(self, doc_id: str):
+        """Returns (file_hash, last_page, done) for a document, or None if never ingested."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT file_hash, last_page, done FROM ingest_progress WHERE doc_id = ?", (doc_id,)
+            ).fetchone()
+        return (row[0], row[1], bool(row[2])) if row else None
+
+    def set_progress(self, doc_id: str, file_hash: str, last_page: int, done: bool = False):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ingest_progress VALUES (?, ?, ?, ?)",
+                (doc_id, file_hash, last_page, int(done)),
+            )
+
+    def delete_doc(self, doc_id: str):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            self.conn.execute("DELETE FROM pages WHERE doc_id = ?", (doc_id,))
+            self.conn.execute("DELETE FROM ingest_progress WHERE doc_id = ?", (doc_id,))
+
+    def vacuum(self):
+        """Rewrites the database file so space freed by deleted documents goes back to the OS."""
+        with self.lock:
+            self.conn.execute("VACUUM")
+
+
+def migrate_payloads(client, collection_name: str, store: TextStore, batch_size: int = 256):
+    """Moves `text` out of existing Qdrant payloads into the store and slims the payloads."""
+    moved = 0
+    offset = None
+    while True:
+        points, offset = client.scroll(collection_name, limit=batch_size, offset=offset, with_payload=True)
+        legacy = [p for p in points if "text" in p.payload]
+        if legacy:
+            store.put_chunks(
+                (str(p.id), p.payload.get("doc_id") or p.payload.get("doc_name"),
+                 p.payload.get("page_number", p.payload.get("page_start", 0)), p.payload["text"])
+                for p in legacy
+            )
+            # doc_name is only kept where it is the filter field (the Streamlit index)
+            server_ids = [p.id for p in legacy if "doc_id" in p.payload]
+            other_ids = [p.id for p in legacy if "doc_id" not in p.payload]
+            if server_ids:
+                client.delete_payload(collection_name, keys=["text", "chunk_id", "doc_name"], points=server_ids)
+            if other_ids:
+                client.delete_payload(collection_name, keys=["text"], points=other_ids)
+            moved += len(legacy)
+        if offset is None:
+            break
+    return moved
+
+
+if __name__ == "__main__":
+    from index_service import connect_index
+    from config import DB_PATH, SERVER_COLLECTION_NAME, SERVER_TEXT_STORE_PATH
+
+    parser = argparse.ArgumentParser(description="Move chunk text from Qdrant payloads into the text store.")
+    parser.add_argument("--db", default=DB_PATH, help="Embedded Qdrant path (ignored when INDEX_URL is set)")
+    parser.add_argument("--collection", default=SERVER_COLLECTION_NAME, help="library_docs for the Streamlit index")
+    parser.add_argument("--store", default=SERVER_TEXT_STORE_PATH, help="library_text.db for the Streamlit index")
+    args = parser.parse_args()
+
+    client = connect_index(args.db)
+    moved = migrate_payloads(client, args.collection, TextStore(args.store))
+    print(f"Moved text for {moved} chunks into {args.store}")